@@ -3,13 +3,9 @@
 import argparse
 import os
 import os.path as op
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
-from dateutil.parser import parse
-
-import numpy as np
-import pandas as pd
-from heudiconv.main import workflow as heudiconv
-from bidsutils.metadata import complete_jsons, clean_metadata
 
 # Local imports
 from bidsify.utils import run, load_dicomdir_metadata, clean_tempdirs
@@ -68,13 +64,24 @@ def _get_parser():
         metavar="HEUR",
         help="Path to a heuristic file or name of a builtin heudiconv heuristic.",
     )
-    parser.add_argument(
+    subj_group = parser.add_mutually_exclusive_group(required=True)
+    subj_group.add_argument(
         "-s",
         "--sub",
-        required=True,
         dest="subject",
         help="The label of the subject to analyze.",
     )
+    subj_group.add_argument(
+        "-S",
+        "--sub-list",
+        type=Path,
+        dest="subject_list",
+        metavar="FILE",
+        help=(
+            "File containing one subject label per line. "
+            "Subjects are processed in parallel."
+        ),
+    )
     parser.add_argument(
         "-ss",
         "--ses",
@@ -131,6 +138,110 @@ def _get_parser():
     return parser
 
 
+@lru_cache(maxsize=None)
+def _validate_heuristic(heuristic):
+    """Check that a heuristic is an existing file or a heudiconv builtin.
+
+    Cached so repeated per-subject invocations with the same heuristic
+    only stat the file once per process.
+
+    Parameters
+    ----------
+    heuristic : str
+        Path to a heuristic file or name of a builtin heudiconv heuristic.
+
+    Returns
+    -------
+    heuristic : str
+        The validated heuristic, unchanged.
+    """
+    # Heuristic may be file or heudiconv builtin
+    # Use existence of file extension to determine if builtin or file
+    if op.splitext(heuristic)[1] and not op.isfile(heuristic):
+        raise ValueError("Heuristic file must be an existing file.")
+    return heuristic
+
+
+def _parse_dicom_date(date_str):
+    """Parse a DICOM DA value (fixed 'YYYYMMDD' format) into a date.
+
+    Parameters
+    ----------
+    date_str : str
+        Date string in DICOM DA format.
+
+    Returns
+    -------
+    datetime.date
+    """
+    from datetime import date
+
+    return date(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:8]))
+
+
+def _scan_outputs(sub_dir):
+    """Collect output files from a subject directory in one pass.
+
+    Parameters
+    ----------
+    sub_dir : pathlib.Path
+        Subject (or subject/session) directory within the BIDS dataset.
+
+    Returns
+    -------
+    out_files : dict
+        Dictionary with keys 'nii', 'json', 'tsv', and 'anat', each mapping
+        to a sorted list of Paths from the datatype subdirectories.
+    """
+    out_files = {"nii": [], "json": [], "tsv": [], "anat": []}
+    if not sub_dir.is_dir():
+        return out_files
+
+    # os.scandir caches entry types from the directory listing, so the
+    # inner loop needs no per-entry stat or fnmatch; only matching
+    # entries are promoted to Path objects
+    for dtype_entry in os.scandir(sub_dir):
+        if not dtype_entry.is_dir(follow_symlinks=False):
+            continue
+
+        for entry in os.scandir(dtype_entry.path):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+
+            if entry.name.endswith(".nii.gz"):
+                out_files["nii"].append(Path(entry.path))
+                if dtype_entry.name == "anat":
+                    out_files["anat"].append(Path(entry.path))
+            elif entry.name.endswith(".json"):
+                out_files["json"].append(Path(entry.path))
+            elif entry.name.endswith(".tsv"):
+                out_files["tsv"].append(Path(entry.path))
+
+    for key in out_files:
+        out_files[key].sort()
+    return out_files
+
+
+def _deface_anat(anat, env):
+    """Deface a single anatomical scan in place with mri_deface.
+
+    Parameters
+    ----------
+    anat : pathlib.Path
+        Anatomical nifti file to deface.
+    env : dict
+        Extra environment variables for the child process.
+    """
+    cmd = [
+        "mri_deface",
+        str(anat),
+        "/src/deface/talairach_mixed_with_skull.gca",
+        "/src/deface/face.gca",
+        str(anat),
+    ]
+    run(cmd, env=env)
+
+
 def bidsify_workflow(
     dicomdir,
     heuristic,
@@ -179,26 +290,27 @@ def bidsify_workflow(
     parent of the output and data directories. This is because Singularity
     cannot mount `/home/data` if it is not in the current path.
     """
+    # Deferred imports, to avoid slowing down the CLI's startup
+    # (e.g., --help) with modules only the workflow itself needs
+    from heudiconv.main import workflow as heudiconv
+    from bidsutils.metadata import complete_jsons, clean_metadata
+
     if isinstance(username, list):
         username = " ".join(username)
 
     if username is not None:
-        cmd = 'git config --global user.name "{}"'.format(username)
-        run(cmd)
+        run(["git", "config", "--global", "user.name", username])
 
     if useremail is not None:
-        cmd = 'git config --global user.email "{}"'.format(useremail)
-        run(cmd)
+        run(["git", "config", "--global", "user.email", useremail])
 
-    # Heuristic may be file or heudiconv builtin
-    # Use existence of file extension to determine if builtin or file
-    if op.splitext(heuristic)[1] and not op.isfile(heuristic):
-        raise ValueError("Heuristic file must be an existing file.")
+    heuristic = _validate_heuristic(heuristic)
 
-    temp_dicom_dir = Path(dicomdir.as_posix().format(subject=subject, session=session))
+    dcm_str = dicomdir.as_posix()
+    temp_dicom_dir = Path(dcm_str.format(subject=subject, session=session))
     dcm_name = temp_dicom_dir.as_posix()
     if temp_dicom_dir.is_file():
-        if not dcm_name.endswith(".gz") or dcm_name.endswith(".tar"):
+        if not dcm_name.endswith((".gz", ".tar")):
             raise ValueError("Heudiconv currently only accepts .tar and .tar.gz inputs")
 
         dir_type = "tarball"
@@ -211,6 +323,7 @@ def bidsify_workflow(
     if session:
         sub_dir = output_dir / f"sub-{subject}/ses-{session}"
 
+    out_str = str(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
     if work_dir is None:
@@ -220,57 +333,58 @@ def bidsify_workflow(
             work_dir = work_dir / session
     work_dir.mkdir(parents=True, exist_ok=True)
     os.environ["TMPDIR"] = work_dir.as_posix()
+    # Built once and reused for every run() call below; .as_posix()
+    # rather than .name, which is only the last path component
+    tmpdir_env = {"TMPDIR": work_dir.as_posix()}
     cwd = os.getcwd()
     os.chdir(work_dir)
 
-    if not (output_dir / ".bidsignore").is_file():
-        to_ignore = [".heudiconv/", ".tmp/", "validator.txt"]
-        with (output_dir / ".bidsignore").open("w") as fo:
+    # Atomic create: one syscall instead of stat+open, and parallel
+    # subject runs cannot race each other rewriting the file
+    try:
+        with (output_dir / ".bidsignore").open("x") as fo:
+            to_ignore = [".heudiconv/", ".tmp/", "validator.txt"]
             fo.write("\n".join(to_ignore))
-
-    # Run heudiconv
+    except FileExistsError:
+        pass
+
+    # Run heudiconv; only the input argument differs between tarball and
+    # folder inputs, so the call is built once
+    heudiconv_kwargs = {
+        "subjs": [subject],
+        "session": session,
+        "heuristic": heuristic,
+        "converter": "dcm2niix",
+        "outdir": out_str,
+        "bids_options": ["all"],
+        "overwrite": True,
+        "minmeta": True,
+        "datalad": datalad,
+    }
     if dir_type == "tarball":
-        heudiconv(
-            dicom_dir_template=dicomdir.as_posix(),
-            subjs=[subject],
-            session=session,
-            heuristic=heuristic,
-            converter="dcm2niix",
-            outdir=str(output_dir),
-            bids_options=["all"],
-            overwrite=True,
-            minmeta=True,
-            datalad=datalad,
-        )
+        heudiconv_kwargs["dicom_dir_template"] = dcm_str
     else:
-        heudiconv(
-            files=dicomdir.as_posix(),
-            subjs=[subject],
-            session=session,
-            heuristic=heuristic,
-            converter="dcm2niix",
-            outdir=str(output_dir),
-            bids_options=["all"],
-            overwrite=True,
-            minmeta=True,
-            datalad=datalad,
-        )
+        heudiconv_kwargs["files"] = dcm_str
+    heudiconv(**heudiconv_kwargs)
 
-    # CHMOD everything
-    nii_files = list(sub_dir.glob("*/*.nii.gz"))
-    json_files = list(sub_dir.glob("*/*.json"))
-    tsv_files = list(sub_dir.glob("*/*.tsv"))
-    for f in nii_files + json_files + tsv_files:
+    # Collect output files with a single scan instead of one glob per
+    # pattern, then CHMOD everything
+    out_files = _scan_outputs(sub_dir)
+    for f in out_files["nii"] + out_files["json"] + out_files["tsv"]:
         os.chmod(os.path.realpath(f), 0o664)
 
-    # Run defacer
-    anat_files = sub_dir.glob("anat/*.nii.gz")
-    for anat in anat_files:
-        cmd = (
-            f"mri_deface {anat} /src/deface/talairach_mixed_with_skull.gca "
-            f"/src/deface/face.gca {anat}"
-        )
-        run(cmd, env={"TMPDIR": work_dir.name})
+    # Run defacer, defacing anatomicals in parallel since each is an
+    # independent single-threaded external process. Threads suffice:
+    # each worker just blocks on its mri_deface subprocess.
+    anat_files = out_files["anat"]
+    if anat_files:
+        n_workers = min(len(anat_files), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(
+                executor.map(
+                    partial(_deface_anat, env=tmpdir_env), anat_files
+                )
+            )
 
     # Add IntendedFor field to field maps and calculate TotalReadoutTime
     complete_jsons(output_dir, subject, session, overwrite=True)
@@ -284,7 +398,10 @@ def bidsify_workflow(
     # Grab some info from the dicoms to add to the participants file
     participants_file = output_dir / "participants.tsv"
     if participants_file.is_file():
-        participant_df = pd.read_table(participants_file, index_col="participant_id")
+        import csv
+        import fcntl
+        import io
+
         data = load_dicomdir_metadata(temp_dicom_dir)
         participant_id = f"sub-{subject}"
         if data.get("PatientAge"):
@@ -292,50 +409,147 @@ def bidsify_workflow(
             try:
                 age = int(age)
             except ValueError:
-                age = np.nan
+                age = "n/a"
         elif data.get("PatientBirthDate"):
-            age = parse(data.StudyDate) - parse(data.PatientBirthDate)
-            age = np.round(age.days / 365.25, 2)
+            age = _parse_dicom_date(data.StudyDate) - _parse_dicom_date(
+                data.PatientBirthDate
+            )
+            age = round(age.days / 365.25, 2)
         else:
-            age = np.nan
-
-        additional_data = pd.DataFrame(
-            columns=["age", "sex", "weight"],
-            data=[[age, data.PatientSex, data.PatientWeight]],
-            index=[participant_id],
-        )
-
-        missing_cols = [
-            col for col in additional_data.columns if col not in data.columns
-        ]
-        for mc in missing_cols:
-            participant_df[mc] = np.nan
-        if participant_id not in participant_df.index.values:
-            participant_df.loc[participant_id] = np.nan
-
-        participant_df.update(additional_data, overwrite=True)
-        participant_df.sort_index(inplace=True)
-        participant_df.to_csv(
-            participants_file,
-            sep="\t",
-            na_rep="n/a",
-            line_terminator="\n",
-            index_label="participant_id",
-        )
+            age = "n/a"
+
+        new_data = {
+            "age": age,
+            "sex": data.PatientSex,
+            "weight": data.PatientWeight,
+        }
+        for key, val in new_data.items():
+            if val in (None, ""):
+                new_data[key] = "n/a"
+
+        # Hold an exclusive lock for the read-modify-write so parallel
+        # subject runs cannot clobber each other's rows. A three-column
+        # table does not need pandas; the csv module avoids both the
+        # import cost and DataFrame allocations.
+        with participants_file.open("r+", newline="") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            content = fh.read()
+            reader = csv.DictReader(io.StringIO(content), delimiter="\t")
+            fieldnames = list(reader.fieldnames or ["participant_id"])
+            rows = {row["participant_id"]: row for row in reader}
+
+            new_cols = [col for col in new_data if col not in fieldnames]
+            is_new = participant_id not in rows
+            row = rows.setdefault(
+                participant_id, {"participant_id": participant_id}
+            )
+            row.update(new_data)
+
+            if is_new and not new_cols:
+                # New participant, existing columns: the handle is at
+                # EOF after the read, so just append the one row. If the
+                # last line is missing its newline, supply it first so
+                # the new row does not fuse onto it.
+                if content and not content.endswith("\n"):
+                    fh.write("\n")
+                writer = csv.DictWriter(
+                    fh,
+                    fieldnames=fieldnames,
+                    delimiter="\t",
+                    lineterminator="\n",
+                    restval="n/a",
+                )
+                writer.writerow(row)
+            else:
+                fieldnames += new_cols
+                fh.seek(0)
+                fh.truncate()
+                writer = csv.DictWriter(
+                    fh,
+                    fieldnames=fieldnames,
+                    delimiter="\t",
+                    lineterminator="\n",
+                    restval="n/a",
+                )
+                writer.writeheader()
+                for pid in sorted(rows):
+                    writer.writerow(rows[pid])
+            # Flush buffered writes to the file before releasing the
+            # lock, or the next locker could read (and append over) a
+            # file that does not yet contain this row
+            fh.flush()
+            fcntl.flock(fh, fcntl.LOCK_UN)
 
     # Run BIDS validator
-    cmd = (
-        f"bids-validator {output_dir} --ignoreWarnings > "
-        f'{work_dir / "validator.txt"}'
-    )
-    run(cmd, env={"TMPDIR": work_dir.name})
+    cmd = ["bids-validator", out_str, "--ignoreWarnings"]
+    with (work_dir / "validator.txt").open("w") as fo:
+        run(cmd, env=tmpdir_env, stdout=fo)
 
     # Go back where you started
     os.chdir(cwd)
 
 
+def bidsify_subjects(
+    subjects,
+    dicomdir,
+    heuristic,
+    session=None,
+    output_dir=".",
+    work_dir=None,
+    datalad=False,
+    username=None,
+    useremail=None,
+):
+    """Run the BIDSification workflow for multiple subjects in parallel.
+
+    Each subject's pipeline is independent, so subjects are distributed
+    across a process pool. Workers are recycled after every subject
+    (maxtasksperchild=1) because bidsify_workflow changes the process's
+    working directory and environment.
+
+    Parameters
+    ----------
+    subjects : list of str
+        Labels of the subjects to analyze.
+
+    Other parameters are passed through to :func:`bidsify_workflow`.
+    """
+    import multiprocessing
+
+    if not subjects:
+        raise ValueError("No subject labels provided.")
+
+    # Fail fast on a bad heuristic before spawning any workers
+    heuristic = _validate_heuristic(heuristic)
+
+    args = [
+        (
+            dicomdir,
+            heuristic,
+            subject,
+            session,
+            output_dir,
+            work_dir,
+            datalad,
+            username,
+            useremail,
+        )
+        for subject in subjects
+    ]
+    n_procs = min(len(subjects), os.cpu_count() or 1)
+    with multiprocessing.Pool(processes=n_procs, maxtasksperchild=1) as pool:
+        pool.starmap(bidsify_workflow, args)
+
+
 def _main(argv=None):
     """Bidsify runtime."""
     options = _get_parser().parse_args(argv)
     kwargs = vars(options)
-    bidsify_workflow(**kwargs)
+    subject_list = kwargs.pop("subject_list")
+    if subject_list is not None:
+        kwargs.pop("subject")
+        with subject_list.open() as fo:
+            subjects = [line.strip() for line in fo if line.strip()]
+        bidsify_subjects(subjects, **kwargs)
+    else:
+        bidsify_workflow(**kwargs)
@@ -1,52 +1,118 @@
 """Utilities used by other modules in cis-bidsify."""
+import copy
+import functools
+import gzip
+import io
+import mmap
 import os
 import sys
 import shutil
 import tarfile
 import subprocess
-from pathlib import Path
+from collections import deque
 
-import pydicom
+# Only these tags are used downstream, so there is no need to parse the
+# full dataset (PixelData included) when reading a dicom header.
+DICOM_TAGS = [
+    "PatientAge",
+    "PatientBirthDate",
+    "StudyDate",
+    "PatientSex",
+    "PatientWeight",
+]
 
 
-def run(command, env=None):
+def run(command, env=None, stdout=None):
     """Run a command with specific environment information.
 
     Parameters
     ----------
-    command: command to be sent to system
+    command: list of str
+        Command to be sent to system, as an argument list.
     env: parameters to be added to environment
+    stdout: optional file object to which stdout is redirected
     """
+    # Merge into a fresh dict so the parent's os.environ is not
+    # polluted by per-call overrides
     merged_env = os.environ
     if env:
-        merged_env.update(env)
+        merged_env = {**os.environ, **env}
 
-    process = subprocess.Popen(
+    # Let the child write straight to our stdout/stderr instead of
+    # shuttling its output through a Python readline loop. Passing an
+    # argument list with shell=False also skips the intermediate sh.
+    sys.stdout.flush()
+    process = subprocess.run(
         command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        shell=True,
+        stdout=stdout,
+        stderr=subprocess.STDOUT if stdout is None else None,
         env=merged_env,
     )
-    while True:
-        line = process.stdout.readline()
-        line = line.decode("utf-8")
-        sys.stdout.write(line)
-        sys.stdout.flush()
-        if line == "" and process.poll() is not None:
-            break
 
     if process.returncode != 0:
         raise Exception(
-            f"Non zero return code: {process.returncode}\n"
-            f"{command}\n\n{process.stdout.read()}"
+            f"Non zero return code: {process.returncode}\n{command}"
         )
     return process.returncode
 
 
+def _first_dcm(dicomdir):
+    """Find the first .dcm file under dicomdir, stopping at the first hit.
+
+    Breadth-first walk with os.scandir over plain path strings: entry
+    types come cached from each directory listing (no stat per file) and
+    no Path objects are allocated for nodes that are only traversed.
+
+    Parameters
+    ----------
+    dicomdir : str or pathlib.Path
+        Directory to search.
+
+    Returns
+    -------
+    path : str or None
+        Path to the first dicom found, or None if there is none.
+    """
+    queue = deque([os.fspath(dicomdir)])
+    while queue:
+        current = queue.popleft()
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    if entry.name.endswith(".dcm"):
+                        return entry.path
+                elif entry.is_dir(follow_symlinks=False):
+                    queue.append(entry.path)
+    return None
+
+
+def _read_dicom_header(f_obj):
+    """Parse the tags of interest from an open dicom file object.
+
+    All tags in DICOM_TAGS live in groups 0x0008 and 0x0010, so parsing
+    stops at the end of the Patient module instead of walking the
+    remaining hundreds of elements up to PixelData.
+    """
+    from pydicom.datadict import tag_for_keyword
+    from pydicom.filereader import read_partial
+    from pydicom.tag import Tag
+
+    stop_tag = Tag(0x0010, 0x4001)
+
+    def _stop(tag, VR, length):
+        return tag >= stop_tag
+
+    # read_partial, unlike dcmread, does not convert keyword strings
+    specific_tags = [Tag(tag_for_keyword(key)) for key in DICOM_TAGS]
+    return read_partial(f_obj, stop_when=_stop, specific_tags=specific_tags)
+
+
 def load_dicomdir_metadata(dicomdir):
     """Grab data from dicom directory of a given type (tar, tar.gz, directory).
 
+    Results are cached per dicomdir, so batch runs over a multi-subject
+    archive only pay for the tar scan once.
+
     Parameters
     ----------
     dicomdir: Directory containing dicoms for processing
@@ -56,18 +122,62 @@ def load_dicomdir_metadata(dicomdir):
     data : dicom header
         DICOM information from first dicom in directory.
     """
+    # Key the cache on (path, mtime, size) so a replaced archive is
+    # re-read. Deep-copy the result: a shallow copy of a pydicom Dataset
+    # shares its element dict, so caller mutations would leak into the
+    # cache. The trimmed Dataset holds five elements, so the copy is cheap.
+    stat = dicomdir.stat()
+    return copy.deepcopy(
+        _load_dicomdir_metadata(dicomdir, stat.st_mtime, stat.st_size)
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _load_dicomdir_metadata(dicomdir, mtime, size):
+    """Read the first dicom header in dicomdir, caching by path and stat."""
     if dicomdir.is_file() and dicomdir.suffix in (".gz", ".tar"):
-        open_type = "r"
-        if dicomdir.suffix == ".gz":
-            open_type = "r:gz"
-        with tarfile.open(dicomdir, open_type) as tar:
-            dicoms = [mem for mem in tar.getmembers() if mem.name.endswith(".dcm")]
-            f_obj = tar.extractfile(dicoms[0])
-            data = pydicom.read_file(f_obj)
+        data = None
+        # Large raw-file buffer plus streaming ('r|') tar mode: the archive
+        # is read once, front to back, with no seeks, which is all the
+        # break-on-first-dicom scan below needs
+        with open(dicomdir, "rb", buffering=1 << 20) as raw:
+            if dicomdir.suffix == ".gz":
+                fileobj = gzip.GzipFile(fileobj=raw)
+            else:
+                # Uncompressed tars can be memory-mapped, letting the OS
+                # page in only the blocks the scan actually touches
+                fileobj = mmap.mmap(
+                    raw.fileno(), 0, prot=mmap.PROT_READ
+                )
+            try:
+                with tarfile.open(
+                    fileobj=fileobj, mode="r|", bufsize=65536
+                ) as tar:
+                    # Iterate lazily and stop at the first dicom instead
+                    # of indexing the full archive with getmembers()
+                    for mem in tar:
+                        if mem.name.endswith(".dcm"):
+                            f_obj = tar.extractfile(mem)
+                            # Pull the member into memory with large reads
+                            # so pydicom's many small reads hit a BytesIO,
+                            # not the gzip stream
+                            buf = io.BytesIO()
+                            shutil.copyfileobj(f_obj, buf, length=1 << 20)
+                            buf.seek(0)
+                            data = _read_dicom_header(buf)
+                            break
+            finally:
+                fileobj.close()
+        if data is None:
+            raise ValueError(f"No dicom files found in {dicomdir}")
     elif dicomdir.is_dir():
-        dcm_files = list(Path(dicomdir).glob("**/*.dcm"))
-        f_obj = dcm_files[0].as_posix()
-        data = pydicom.read_file(f_obj)
+        # Stop walking the tree at the first match rather than
+        # materializing the full recursive listing
+        dcm_file = _first_dcm(dicomdir)
+        if dcm_file is None:
+            raise ValueError(f"No dicom files found in {dicomdir}")
+        with open(dcm_file, "rb") as f_obj:
+            data = _read_dicom_header(f_obj)
     else:
         raise ValueError(
             "dicomdir is neither file nor directory, "
@@ -77,6 +187,40 @@ def load_dicomdir_metadata(dicomdir):
     return data
 
 
+def _fast_rmtree(path):
+    """Remove a directory tree using scandir's cached entry types.
+
+    Unlike shutil.rmtree, entries are classified from the directory
+    listing itself (no stat per file), which matters for .heudiconv
+    trees with thousands of intermediates on networked filesystems.
+    Errors are swallowed like shutil.rmtree(..., ignore_errors=True), so
+    parallel subject runs racing over the same temp roots are harmless.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Directory tree to remove.
+    """
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            _fast_rmtree(entry.path)
+        else:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
 def clean_tempdirs(output_dir, sub, ses):
     """Clean up working directories (.heudiconv and .tmp).
 
@@ -89,20 +233,31 @@ def clean_tempdirs(output_dir, sub, ses):
     sub: Subject ID
     ses: Session ID, if required
     """
+    # One listing of output_dir yields DirEntry objects with cached types
+    # for every temp root, instead of a separate is_dir() stat per path
+    with os.scandir(output_dir) as it:
+        root_entries = {e.name: e for e in it if e.is_dir()}
+
     for root in [".heudiconv"]:
+        root_entry = root_entries.get(root)
+        if root_entry is None:
+            continue
+
+        # _fast_rmtree treats missing paths as a no-op, so no pre-flight
+        # stat is needed per path
         if ses:
             if root == ".heudiconv":
-                print(
-                    "Removing Temp Directory: ", output_dir / root / sub / f"ses-{ses}"
-                )
-                shutil.rmtree(output_dir / root / sub / f"ses-{ses}")
+                ses_dir = output_dir / root / sub / f"ses-{ses}"
             else:
-                print("Removing Temp Directory: ", output_dir / root / sub / ses)
-                shutil.rmtree(output_dir / root / sub / ses)
-        if (output_dir / root / sub).is_dir():
-            print("Removing Temp Directory: ", output_dir / root / sub)
-            shutil.rmtree(output_dir / root / sub)
-        if (output_dir / root).is_dir():
-            if not (output_dir / root).iterdir():
-                print("Removing Temp Directory: ", output_dir / root)
-                shutil.rmtree((output_dir / root))
+                ses_dir = output_dir / root / sub / ses
+            print("Removing Temp Directory: ", ses_dir)
+            _fast_rmtree(ses_dir)
+        print("Removing Temp Directory: ", output_dir / root / sub)
+        _fast_rmtree(output_dir / root / sub)
+        # scandir returns after the first entry instead of materializing
+        # the full listing just to test emptiness
+        with os.scandir(root_entry.path) as it:
+            empty = next(it, None) is None
+        if empty:
+            print("Removing Temp Directory: ", output_dir / root)
+            _fast_rmtree(output_dir / root)